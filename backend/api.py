@@ -1,8 +1,16 @@
+import glob
+import gzip
+import hashlib
 import json
-from flask import Flask, abort
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, List, Optional, Tuple, Union
+from flask import Flask, Response, abort, request
 from flask_cors import CORS
+from werkzeug.wsgi import wrap_file
 import os
-from util import read_district_data
 
 app = Flask(__name__)
 CORS(app)
@@ -10,33 +18,375 @@ CORS(app)
 # with open("data/out/annual_infos.json", "r") as f:
 #     annual_infos = json.load(f)
 
-annual_infos = {}
 root_dir = "data/out/"
+# Upper bound on the response bytes (plain + gzip) each worker keeps in memory.
+CACHE_BYTES = int(os.environ.get("API_CACHE_MB", "256")) * 1024 * 1024
+# Serve pre-built files from disk instead, so every worker shares the same
+# page cache rather than holding its own copy of each payload.
+SHARED_FILES = os.environ.get("API_SHARED_FILES", "0") == "1"
+# How often a cached payload checks whether its files under data/out/ were
+# regenerated.
+RELOAD_SECONDS = float(os.environ.get("API_RELOAD_SECONDS", "5"))
 
-for subdir in os.listdir(root_dir):
-    subdir_path = os.path.join(root_dir, subdir)
 
-    if os.path.isdir(subdir_path):
-        annual_infos_path = os.path.join(subdir_path, "annual_info.json")
-        if os.path.exists(annual_infos_path):
-            with open(annual_infos_path, "r") as file:
-                annual_data = json.load(file)
-                annual_infos[subdir.split("/")[-1]] = annual_data
+def annual_info_path(district_key: str) -> str:
+    return os.path.join(root_dir, district_key, "annual_info.json")
+
+
+def district_index_path(district_key: str) -> str:
+    return os.path.join(root_dir, district_key, "district", "index.json")
+
+
+def district_keys() -> List[str]:
+    return sorted(
+        d for d in os.listdir(root_dir) if os.path.exists(annual_info_path(d))
+    )
+
+
+def stamp(paths: List[str]) -> str:
+    # Changes whenever any source file is rewritten, without reading them.
+    h = hashlib.sha256()
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_ino}:{st.st_mtime_ns}:{st.st_size};".encode())
+
+    return h.hexdigest()[:32]
+
+
+FileId = Tuple[int, int, int]
+
+
+def file_id(st: os.stat_result) -> FileId:
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def older_than(path: str, mtime: float) -> bool:
+    return not os.path.exists(path) or os.path.getmtime(path) < mtime
+
+
+def write_atomic(path: str, data: bytes):
+    # Several workers may build the same file at once; whoever renames last
+    # wins and readers only ever see a complete file.
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+
+    os.replace(tmp, path)
+
+
+@dataclass(frozen=True)
+class Source:
+    # The files a route is built from, and how to turn them into its body.
+    paths: List[str]
+    build: Callable[[], bytes]
+
+
+def single_file(path: str) -> Source:
+    return Source(paths=[path], build=lambda: read_bytes(path))
+
+
+def combined_annual_infos() -> Source:
+    paths = {key: annual_info_path(key) for key in district_keys()}
+
+    # The files are already JSON, so the combined object is spliced together
+    # from their bytes rather than parsed and dumped again.
+    def build() -> bytes:
+        return (
+            b"{"
+            + b",".join(
+                json.dumps(key).encode() + b":" + read_bytes(path)
+                for key, path in paths.items()
+            )
+            + b"}"
+        )
+
+    return Source(paths=list(paths.values()), build=build)
+
+
+@dataclass(frozen=True)
+class Payload:
+    # A response body encoded once up front, so requests never touch json.
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+    @classmethod
+    def from_source(cls, source: Source) -> "Payload":
+        etag = stamp(source.paths)
+        body = source.build()
+        return cls(body=body, gzipped=gzip.compress(body, mtime=0), etag=etag)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzipped)
+
+    def make_response(self, use_gzip: bool) -> Response:
+        return Response(
+            self.gzipped if use_gzip else self.body, mimetype="application/json"
+        )
+
+
+@dataclass(frozen=True)
+class FilePayload:
+    body_path: str
+    gzipped_path: str
+    etag: str
+    # Which files were on disk when etag was taken, so a file replaced since
+    # is never served under it.
+    body_id: FileId
+    gzipped_id: FileId
+
+    @classmethod
+    def from_source(cls, source: Source, body_path: str) -> "FilePayload":
+        while True:
+            etag = stamp(source.paths)
+            # ctime, unlike mtime, can't be carried over from an older copy.
+            newest = max(os.stat(path).st_ctime for path in source.paths)
+            if body_path not in source.paths and older_than(body_path, newest):
+                write_atomic(body_path, source.build())
+
+            with open(body_path, "rb") as f:
+                body_id = file_id(os.fstat(f.fileno()))
+                # Named after the body it was compressed from, so it can never
+                # be paired with any other version of it.
+                gzipped_path = f"{body_path}.{'-'.join(map(str, body_id))}.gz"
+                if not os.path.exists(gzipped_path):
+                    gzipped = gzip.compress(f.read(), mtime=0)
+                    if file_id(os.fstat(f.fileno())) != body_id:
+                        continue
+
+                    write_atomic(gzipped_path, gzipped)
+
+            gzipped_id = file_id(os.stat(gzipped_path))
+            # A source rewritten part way through may have left the files out
+            # of step with etag, so start over.
+            if stamp(source.paths) != etag:
+                continue
+
+            for path in glob.glob(f"{glob.escape(body_path)}.*.gz"):
+                if path != gzipped_path:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+            return cls(
+                body_path=body_path,
+                gzipped_path=gzipped_path,
+                etag=etag,
+                body_id=body_id,
+                gzipped_id=gzipped_id,
+            )
+
+    @property
+    def size(self) -> int:
+        return 0
+
+    def open(self, use_gzip: bool) -> Optional[BinaryIO]:
+        # None once the file has been replaced or removed; the payload must be
+        # rebuilt.
+        path = self.gzipped_path if use_gzip else self.body_path
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        if file_id(os.fstat(f.fileno())) != (
+            self.gzipped_id if use_gzip else self.body_id
+        ):
+            f.close()
+            return None
+
+        return f
+
+    def make_response(self, use_gzip: bool) -> Optional[Response]:
+        f = self.open(use_gzip)
+        if f is None:
+            return None
+
+        # wsgi.file_wrapper lets gunicorn sendfile() straight from the page
+        # cache.
+        response = Response(
+            wrap_file(request.environ, f),
+            mimetype="application/json",
+            direct_passthrough=True,
+        )
+        response.content_length = os.fstat(f.fileno()).st_size
+        return response
+
+
+AnyPayload = Union[Payload, FilePayload]
+
+
+@dataclass
+class CacheEntry:
+    payload: AnyPayload
+    checked_at: float
+
+
+class PayloadCache:
+    # Least recently used payloads are dropped once their bytes add up to more
+    # than max_bytes; the most recent one is always kept. An entry whose source
+    # files have been rewritten is rebuilt and swapped in, at most one stat per
+    # check_seconds, while other requests keep getting the old payload.
+    def __init__(self, max_bytes: int, check_seconds: float) -> None:
+        self.max_bytes = max_bytes
+        self.check_seconds = check_seconds
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def fresh(self, key: str) -> Optional[AnyPayload]:
+        # The cached payload if it was checked recently enough to skip any I/O.
+        with self.lock:
+            entry = self.entries.get(key)
+            if (
+                entry is None
+                or time.monotonic() - entry.checked_at >= self.check_seconds
+            ):
+                return None
+
+            self.entries.move_to_end(key)
+            return entry.payload
+
+    def get(
+        self,
+        key: str,
+        make_source: Callable[[], Source],
+        build: Callable[[Source], AnyPayload],
+        force: bool = False,
+    ) -> AnyPayload:
+        # force rebuilds the payload even if its sources look unchanged.
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if not force and now - entry.checked_at < self.check_seconds:
+                    return entry.payload
+
+                entry.checked_at = now
+
+        source = make_source()
+        if (
+            not force
+            and entry is not None
+            and stamp(source.paths) == entry.payload.etag
+        ):
+            return entry.payload
+
+        payload = build(source)
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.payload.size
+
+            self.entries[key] = CacheEntry(payload=payload, checked_at=now)
+            self.size += payload.size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.payload.size
+
+        return payload
+
+
+payloads = PayloadCache(CACHE_BYTES, RELOAD_SECONDS)
+
+
+@dataclass(frozen=True)
+class Route:
+    # What a URL is served from: its cache key, its source files, and where the
+    # pre-built body lives on disk in shared-file mode.
+    key: str
+    make_source: Callable[[], Source]
+    body_path: str
+
+
+def district_file_route(
+    district_key: str, path_for: Callable[[str], str]
+) -> Optional[Route]:
+    if not district_key.isalnum():
+        return None
+
+    path = path_for(district_key)
+    if not os.path.exists(path):
+        return None
+
+    return Route(key=path, make_source=lambda: single_file(path), body_path=path)
+
+
+ALL_ANNUAL_INFOS = Route(
+    key="all_annual_infos",
+    make_source=combined_annual_infos,
+    body_path=os.path.join(root_dir, "all_annual_infos.json"),
+)
+
+
+def load_payload(route: Route, force: bool = False) -> AnyPayload:
+    if SHARED_FILES:
+        return payloads.get(
+            route.key,
+            route.make_source,
+            lambda source: FilePayload.from_source(source, route.body_path),
+            force,
+        )
+
+    return payloads.get(route.key, route.make_source, Payload.from_source, force)
+
+
+def representation_etag(payload: AnyPayload, use_gzip: bool) -> str:
+    # Each encoding is a different representation, so it gets its own tag.
+    return f"{payload.etag}-gzip" if use_gzip else payload.etag
+
+
+def respond(route: Route) -> Response:
+    payload = load_payload(route)
+    use_gzip = request.accept_encodings["gzip"] > 0
+    etag = representation_etag(payload, use_gzip)
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = payload.make_response(use_gzip)
+        while response is None:
+            # Its file was replaced since it was built, so rebuild rather than
+            # send the new bytes under the old tag.
+            payload = load_payload(route, force=True)
+            etag = representation_etag(payload, use_gzip)
+            response = payload.make_response(use_gzip)
+
+        if use_gzip:
+            response.content_encoding = "gzip"
+
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 @app.route("/district/<district_key>/annual_infos")
 def district_annual_infos(district_key: str):
-    if district_key not in annual_infos:
+    route = district_file_route(district_key, annual_info_path)
+    if route is None:
         abort(400, "no district")
 
-    return annual_infos[district_key]
+    return respond(route)
 
 
 @app.route("/all/annual_infos")
 def all_annual_infos():
-    return annual_infos
+    return respond(ALL_ANNUAL_INFOS)
 
 
 @app.route("/d/<district_key>")
 def district_index(district_key: str):
-    return read_district_data(district_key, "district/index.json")
+    route = district_file_route(district_key, district_index_path)
+    if route is None:
+        abort(404)
+
+    return respond(route)
@@ -1,7 +1,7 @@
 import enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, List, Optional
-from dataclasses_json import dataclass_json
+from dataclasses_json import config, dataclass_json
 
 
 @enum.unique
@@ -169,7 +169,7 @@ class AlliancePlacement(enum.IntEnum):
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class Record:
     won: int
     lost: int
@@ -187,7 +187,7 @@ class Record:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class SimpleTeam:
     key: str
     number: int
@@ -200,7 +200,7 @@ class SimpleTeam:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class TeamEventEPA:
     mean: float
     sd: float
@@ -209,7 +209,7 @@ class TeamEventEPA:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class TeamEvent:
     team_key: str
     event_key: str
@@ -244,14 +244,14 @@ class AnnualSlots:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class Award:
     award_type: AwardType
     recipient_team: str
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class Alliance:
     teams: List[str]
     captain: str
@@ -287,7 +287,7 @@ class Event:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class DistrictRanking:
     qualifying_points_individual: List[int]
     qualifying_points_total: int
@@ -308,6 +308,15 @@ class AnnualInfo:
     rankings: List[DistrictRanking]
 
 
+def index_teams_by_year(all_teams: Dict[str, SimpleTeam]) -> Dict[int, List[str]]:
+    index: Dict[int, List[str]] = {}
+    for t in sorted(all_teams.values(), key=lambda t: t.number):
+        for y in t.active_years:
+            index.setdefault(y, []).append(t.key)
+
+    return dict(sorted(index.items()))
+
+
 @dataclass_json
 @dataclass
 class DistrictSummary:
@@ -315,6 +324,17 @@ class DistrictSummary:
     key: str
     name: str
     first_year: int
+    # year -> keys of the teams active that year, sorted by number. Left out of
+    # to_dict() so district/index.json keeps its shape.
+    teams_by_year: Dict[int, List[str]] = field(
+        default_factory=dict, metadata=config(exclude=lambda _: True)
+    )
+
+    def __post_init__(self):
+        # Built from all_teams when the summary is generated, or when it is read
+        # from a file written before the index existed.
+        if not self.teams_by_year:
+            self.teams_by_year = index_teams_by_year(self.all_teams)
 
 
 @dataclass_json
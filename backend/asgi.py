@@ -0,0 +1,179 @@
+import asyncio
+import os
+import re
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from api import (
+    ALL_ANNUAL_INFOS,
+    AnyPayload,
+    FilePayload,
+    Route,
+    annual_info_path,
+    district_file_route,
+    district_index_path,
+    load_payload,
+    payloads,
+    representation_etag,
+)
+
+# The same routes as api.py, for async workers, e.g.
+#   gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+# Payloads come from the same cache, so API_CACHE_MB, API_SHARED_FILES and
+# API_RELOAD_SECONDS all behave the same way here.
+
+CHUNK_SIZE = 256 * 1024
+DISTRICT_ANNUAL_INFOS = re.compile(r"^/district/([^/]+)/annual_infos$")
+DISTRICT_INDEX = re.compile(r"^/d/([^/]+)$")
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def resolve(path: str) -> Tuple[Optional[Route], int]:
+    if path == "/all/annual_infos":
+        return ALL_ANNUAL_INFOS, 200
+
+    if match := DISTRICT_ANNUAL_INFOS.match(path):
+        return district_file_route(match[1], annual_info_path), 400
+
+    if match := DISTRICT_INDEX.match(path):
+        return district_file_route(match[1], district_index_path), 404
+
+    return None, 404
+
+
+def quality(params: List[str]) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0
+
+    return 1
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    # An explicit gzip entry wins over "*", as it does in werkzeug.
+    qualities: Dict[str, float] = {}
+    for coding in accept_encoding.split(","):
+        name, *params = coding.split(";")
+        qualities.setdefault(name.strip().lower(), quality(params))
+
+    return qualities.get("gzip", qualities.get("*", 0)) > 0
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison, as If-None-Match requires.
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or f'"{etag}"' in tags
+
+
+async def send_status(send, status: int, message: bytes = b""):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(message)).encode()),
+                (b"access-control-allow-origin", b"*"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": message})
+
+
+def headers(etag: str) -> Headers:
+    return [
+        (b"etag", f'"{etag}"'.encode()),
+        (b"vary", b"Accept-Encoding"),
+        (b"access-control-allow-origin", b"*"),
+    ]
+
+
+async def send_start(send, etag: str, use_gzip: bool, content_length: int):
+    response_headers = headers(etag)
+    response_headers.append((b"content-type", b"application/json"))
+    if use_gzip:
+        response_headers.append((b"content-encoding", b"gzip"))
+    response_headers.append((b"content-length", str(content_length).encode()))
+    await send(
+        {"type": "http.response.start", "status": 200, "headers": response_headers}
+    )
+
+
+def open_file(
+    route: Route, payload: FilePayload, use_gzip: bool
+) -> Tuple[FilePayload, BinaryIO, int]:
+    f = payload.open(use_gzip)
+    while f is None:
+        # Its file was replaced since it was built, so rebuild rather than send
+        # the new bytes under the old tag.
+        payload = load_payload(route, force=True)
+        f = payload.open(use_gzip)
+
+    return payload, f, os.fstat(f.fileno()).st_size
+
+
+async def send_file(scope: Dict, send, f: BinaryIO, head: bool):
+    # Sent from the already opened file rather than by path, so it is the one
+    # the payload checked, even if the path is replaced in the meantime.
+    extensions = scope.get("extensions") or {}
+    if head:
+        await send({"type": "http.response.body", "body": b""})
+    elif "http.response.zerocopysend" in extensions:
+        await send({"type": "http.response.zerocopysend", "file": f})
+    else:
+        # No zero-copy support in the server, so stream it in chunks instead.
+        while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def app(scope: Dict, receive, send):
+    if scope["type"] == "lifespan":
+        while (await receive())["type"] != "lifespan.shutdown":
+            await send({"type": "lifespan.startup.complete"})
+        await send({"type": "lifespan.shutdown.complete"})
+        return
+
+    if scope["method"] not in ("GET", "HEAD"):
+        await send_status(send, 405)
+        return
+
+    route, missing_status = resolve(scope["path"])
+    if route is None:
+        await send_status(send, missing_status, b"no district")
+        return
+
+    payload: Optional[AnyPayload] = payloads.fresh(route.key)
+    if payload is None:
+        # Building or re-checking a payload reads files, so keep it off the
+        # event loop.
+        payload = await asyncio.to_thread(load_payload, route)
+
+    request_headers = {k.lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    use_gzip = accepts_gzip(request_headers.get(b"accept-encoding", ""))
+    etag = representation_etag(payload, use_gzip)
+
+    if etag_matches(request_headers.get(b"if-none-match", ""), etag):
+        await send(
+            {"type": "http.response.start", "status": 304, "headers": headers(etag)}
+        )
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    head = scope["method"] == "HEAD"
+    if isinstance(payload, FilePayload):
+        # Opening and checking the file is disk I/O too.
+        payload, f, size = await asyncio.to_thread(open_file, route, payload, use_gzip)
+        with f:
+            etag = representation_etag(payload, use_gzip)
+            await send_start(send, etag, use_gzip, size)
+            await send_file(scope, send, f, head)
+        return
+
+    body = payload.gzipped if use_gzip else payload.body
+    await send_start(send, etag, use_gzip, len(body))
+    await send({"type": "http.response.body", "body": b"" if head else body})
@@ -0,0 +1,463 @@
+import asyncio
+import gc
+import glob
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import time
+import timeit
+import tracemalloc
+import warnings
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import aiohttp
+import click
+import numpy as np
+
+from api_types import DistrictInfo, EventType
+from processors import (
+    DCMP_TYPES,
+    compute_outputs,
+    flatten_team_events,
+    team_event_aggregates,
+)
+from util import Averager, read_district_data
+from decoders import decode_district_info, load_district_info, loads
+from getters import index_award_types, index_match_keys
+
+
+@click.group()
+def cli():
+    pass
+
+
+def scan_match_keys(matches: List[Dict], team_key: str) -> List[str]:
+    return [
+        m["key"]
+        for m in matches
+        if (
+            team_key in m["alliances"]["blue"]["team_keys"]
+            or team_key in m["alliances"]["red"]["team_keys"]
+        )
+    ]
+
+
+def scan_award_types(awards: List[Dict], team_key: str) -> List[int]:
+    return [
+        award["award_type"]
+        for award in awards
+        if any(
+            recipient["team_key"] == team_key for recipient in award["recipient_list"]
+        )
+    ]
+
+
+@cli.command()
+@click.option("--district", default="fnc", show_default=True)
+@click.option("--number", default=20, show_default=True)
+def team_event_index(district: str, number: int):
+    with open(f"data/out/{district}/annual_info.json", "r") as f:
+        data = json.load(f)
+
+    # The biggest DCMP on disk, with its awards turned back into TBA's shape.
+    event = max(
+        (
+            e
+            for ai in data["annual_info"].values()
+            for e in ai["events"]
+            if e["event_type"]
+            in [EventType.DISTRICT_CMP, EventType.DISTRICT_CMP_DIVISION]
+        ),
+        key=lambda e: len(e["matches"]),
+    )
+    recipients = defaultdict(list)
+    for a in event["awards"]:
+        recipients[a["award_type"]].append({"team_key": a["recipient_team"]})
+    awards = [
+        {"award_type": award_type, "recipient_list": recipient_list}
+        for award_type, recipient_list in recipients.items()
+    ]
+    matches = event["matches"]
+    team_keys = list(event["district_pts"].keys())
+
+    def scan():
+        for tk in team_keys:
+            scan_match_keys(matches, tk)
+            scan_award_types(awards, tk)
+
+    def indexed():
+        team_matches = index_match_keys(matches)
+        team_awards = index_award_types(awards)
+        for tk in team_keys:
+            team_matches.get(tk, [])
+            team_awards.get(tk, [])
+
+    scan_time = timeit.timeit(scan, number=number) / number
+    indexed_time = timeit.timeit(indexed, number=number) / number
+
+    print(
+        f"{event['key']}: {len(team_keys)} teams, {len(matches)} matches, "
+        f"{len(awards)} awards"
+    )
+    print(f"scan:    {scan_time * 1000:8.3f} ms")
+    print(f"indexed: {indexed_time * 1000:8.3f} ms ({scan_time / indexed_time:.1f}x)")
+
+
+@cli.command()
+@click.option("--number", default=3, show_default=True)
+def decode(number: int):
+    # dataclasses_json warns about None in non-Optional fields (e.g. event week).
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    for path in sorted(glob.glob("data/out/*/annual_info.json")):
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        def with_from_dict():
+            return DistrictInfo.from_dict(json.loads(raw))
+
+        def with_decoder():
+            return decode_district_info(loads(raw))
+
+        assert with_from_dict() == with_decoder()
+
+        from_dict_time = timeit.timeit(with_from_dict, number=number) / number
+        decoder_time = timeit.timeit(with_decoder, number=number) / number
+        print(
+            f"{path}: from_dict {from_dict_time * 1000:8.1f} ms, "
+            f"decoder {decoder_time * 1000:6.1f} ms "
+            f"({from_dict_time / decoder_time:.1f}x)"
+        )
+
+
+def loop_team_aggregates(info: DistrictInfo) -> Dict[str, Dict]:
+    # What process_district_index used to do per team and year.
+    aggregates = {}
+    for tk, t in info.summary.all_teams.items():
+        record = {"wins": 0, "losses": 0, "ties": 0}
+        dcmps = 0
+        dpts_averager = Averager()
+        for y in t.active_years:
+            team_events = info.annual_info[y].team_events[tk]
+            for te in team_events:
+                if te.total_record is not None:
+                    record["wins"] += te.total_record.won
+                    record["losses"] += te.total_record.lost
+                    record["ties"] += te.total_record.tied
+
+            first_two_plays = [
+                te
+                for te in sorted(team_events, key=lambda x: x.event_week)
+                if te.event_type == EventType.DISTRICT
+            ][:2]
+            dpts_averager.feed_many([x.total_pts for x in first_two_plays])
+
+            if any(te.event_type in DCMP_TYPES for te in team_events):
+                dcmps += 1
+
+        aggregates[tk] = (record, dcmps, dpts_averager.get())
+
+    return aggregates
+
+
+@cli.command()
+@click.option("--district", "districts", multiple=True)
+@click.option("--number", default=50, show_default=True)
+def team_aggregates(districts: List[str], number: int):
+    paths = (
+        [f"data/out/{d}/annual_info.json" for d in districts]
+        if districts
+        else sorted(glob.glob("data/out/*/annual_info.json"))
+    )
+    for path in paths:
+        info = load_district_info(path)
+        team_events = flatten_team_events(info)
+
+        def vectorized():
+            return team_event_aggregates(info, flatten_team_events(info))
+
+        loop_time = timeit.timeit(lambda: loop_team_aggregates(info), number=number)
+        flatten_time = timeit.timeit(lambda: flatten_team_events(info), number=number)
+        vectorized_time = timeit.timeit(vectorized, number=number)
+        print(
+            f"{path}: {len(team_events['team'])} team events, "
+            f"loops {loop_time / number * 1000:6.2f} ms, "
+            f"flatten + grouped {vectorized_time / number * 1000:6.2f} ms "
+            f"(flatten {flatten_time / number * 1000:.2f} ms, "
+            f"{loop_time / vectorized_time:.1f}x)"
+        )
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+@cli.command()
+def memory():
+    gc.collect()
+    before = rss_mb()
+    tracemalloc.start()
+
+    infos = {}
+    for path in sorted(glob.glob("data/out/*/annual_info.json")):
+        infos[path] = load_district_info(path)
+    gc.collect()
+
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    team_events = sum(
+        len(tes)
+        for info in infos.values()
+        for ai in info.annual_info.values()
+        for tes in ai.team_events.values()
+    )
+    print(f"{len(infos)} districts, {team_events} team events")
+    print(f"RSS: {before:.1f} MB -> {rss_mb():.1f} MB")
+    print(f"retained by loaded objects: {retained / 1024 / 1024:.1f} MB")
+
+
+LOAD_TEST_SERVERS = {
+    # What docker-compose runs today: sync workers.
+    "gunicorn": ["gunicorn", "main:app"],
+    "asgi": ["gunicorn", "-k", "uvicorn.workers.UvicornWorker", "asgi:app"],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_until_up(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as r:
+                    await r.read()
+                    return
+            except aiohttp.ClientConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+
+                await asyncio.sleep(0.2)
+
+
+async def hammer(url: str, connections: int, duration: float) -> List[float]:
+    latencies: List[float] = []
+    deadline = time.monotonic() + duration
+
+    async def worker(session: aiohttp.ClientSession):
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            async with session.get(url) as r:
+                await r.read()
+                assert r.status == 200, r.status
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=connections),
+        headers={"Accept-Encoding": "gzip"},
+        auto_decompress=False,
+    ) as session:
+        await asyncio.gather(*[worker(session) for _ in range(connections)])
+
+    return latencies
+
+
+@cli.command()
+@click.option(
+    "--server",
+    "servers",
+    type=click.Choice(list(LOAD_TEST_SERVERS)),
+    multiple=True,
+    default=list(LOAD_TEST_SERVERS),
+    show_default=True,
+)
+@click.option(
+    "--path",
+    "paths",
+    multiple=True,
+    default=["/d/fnc", "/district/fnc/annual_infos", "/all/annual_infos"],
+    show_default=True,
+)
+@click.option("--workers", default=2, show_default=True)
+@click.option("--connections", default=32, show_default=True)
+@click.option("--duration", default=10.0, show_default=True)
+def load_test(
+    servers: List[str],
+    paths: List[str],
+    workers: int,
+    connections: int,
+    duration: float,
+):
+    for server in servers:
+        port = free_port()
+        proc = subprocess.Popen(
+            LOAD_TEST_SERVERS[server][:1]
+            + ["-b", f"127.0.0.1:{port}", "-w", str(workers)]
+            + LOAD_TEST_SERVERS[server][1:],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            base = f"http://127.0.0.1:{port}"
+            asyncio.run(wait_until_up(base + paths[0]))
+            for path in paths:
+                # Warm every worker's cache before measuring.
+                asyncio.run(hammer(base + path, connections, 1))
+                latencies = np.array(
+                    asyncio.run(hammer(base + path, connections, duration))
+                )
+                print(
+                    f"{server:8} {path:28} {len(latencies) / duration:8.0f} req/s  "
+                    f"p50 {np.percentile(latencies, 50) * 1000:7.2f} ms  "
+                    f"p99 {np.percentile(latencies, 99) * 1000:7.2f} ms"
+                )
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def measure(fn: Callable[[], object], number: int, repeat: int) -> Dict[str, float]:
+    fn()
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = [t / number for t in timeit.repeat(fn, number=number, repeat=repeat)]
+    return {
+        "seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "peak_bytes": peak,
+    }
+
+
+def suite_cases() -> Dict[str, Callable[[], object]]:
+    from api import app
+
+    client = app.test_client()
+    cases: Dict[str, Callable[[], object]] = {}
+
+    def route(url: str) -> Callable[[], object]:
+        def get():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return response.data
+
+        return get
+
+    for path in sorted(glob.glob("data/out/*/annual_info.json")):
+        district = path.split("/")[-2]
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        info = load_district_info(path)
+        cases[f"from_dict/{district}"] = lambda raw=raw: DistrictInfo.from_dict(
+            json.loads(raw)
+        )
+        cases[f"process_district_index/{district}"] = lambda info=info: (
+            compute_outputs(["district/index.json"], lambda: info)
+        )
+        cases[f"route/district/{district}/annual_infos"] = route(
+            f"/district/{district}/annual_infos"
+        )
+
+    for path in sorted(glob.glob("data/out/*/district/index.json")):
+        district = path.split("/")[-3]
+        cases[f"read_district_data/{district}"] = (
+            lambda district=district: read_district_data(
+                district, "district/index.json"
+            )
+        )
+        cases[f"route/d/{district}"] = route(f"/d/{district}")
+
+    cases["route/all/annual_infos"] = route("/all/annual_infos")
+    return cases
+
+
+@cli.command()
+@click.option("--output", default="bench_results.json", show_default=True)
+@click.option("--number", default=5, show_default=True)
+@click.option("--repeat", default=3, show_default=True)
+@click.option("--only", default="", help="Only run cases starting with this.")
+def suite(output: str, number: int, repeat: int, only: str):
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    results = {}
+    for name, fn in suite_cases().items():
+        if not name.startswith(only):
+            continue
+
+        results[name] = measure(fn, number, repeat)
+        print(
+            f"{name:40} {results[name]['seconds'] * 1000:9.3f} ms "
+            f"{results[name]['peak_bytes'] / 1024 / 1024:8.2f} MB peak"
+        )
+
+    with open(output, "w+") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "time": time.time(),
+                "results": results,
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True))
+@click.argument("current", type=click.Path(exists=True))
+@click.option(
+    "--threshold",
+    default=0.1,
+    show_default=True,
+    help="Relative slowdown or memory growth that counts as a regression.",
+)
+def compare(baseline: str, current: str, threshold: float):
+    with open(baseline, "r") as f:
+        before = json.load(f)["results"]
+    with open(current, "r") as f:
+        after = json.load(f)["results"]
+
+    regressions = []
+    for name in sorted(set(before) | set(after)):
+        if name not in before or name not in after:
+            print(f"{name:40} only in {'current' if name in after else 'baseline'}")
+            continue
+
+        flags = []
+        for metric in ["seconds", "peak_bytes"]:
+            ratio = after[name][metric] / max(before[name][metric], 1e-12)
+            if ratio > 1 + threshold:
+                flags.append(f"{metric} {ratio:.2f}x")
+
+        print(
+            f"{name:40} {before[name]['seconds'] * 1000:9.3f} -> "
+            f"{after[name]['seconds'] * 1000:9.3f} ms "
+            f"{'REGRESSION ' + ', '.join(flags) if flags else ''}"
+        )
+        if flags:
+            regressions.append(name)
+
+    if regressions:
+        raise click.ClickException(
+            f"{len(regressions)} regression(s): {', '.join(regressions)}"
+        )
+
+
+if __name__ == "__main__":
+    cli()
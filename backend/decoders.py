@@ -0,0 +1,199 @@
+import json
+from typing import Any, Dict, Optional
+
+import orjson
+
+from api_types import (
+    Alliance,
+    AlliancePlacement,
+    AnnualInfo,
+    AnnualSlots,
+    Award,
+    AwardType,
+    DistrictInfo,
+    DistrictRanking,
+    DistrictSummary,
+    Event,
+    EventType,
+    Record,
+    SimpleTeam,
+    TeamEvent,
+    TeamEventEPA,
+)
+
+# Hand-written equivalents of the dataclasses_json `from_dict`s for the types in
+# api_types. They coerce scalars the same way (int/float fields are cast, None
+# is kept as None) but skip the per-field type introspection.
+
+
+def as_int(v) -> Optional[int]:
+    return None if v is None else int(v)
+
+
+def as_float(v) -> Optional[float]:
+    return None if v is None else float(v)
+
+
+def decode_record(d: Optional[Dict]) -> Optional[Record]:
+    if d is None:
+        return None
+
+    return Record(won=as_int(d["won"]), lost=as_int(d["lost"]), tied=as_int(d["tied"]))
+
+
+def decode_simple_team(d: Dict) -> SimpleTeam:
+    return SimpleTeam(
+        key=d["key"],
+        number=as_int(d["number"]),
+        name=d["name"],
+        city=d["city"],
+        state_prov=d["state_prov"],
+        country=d["country"],
+        rookie_year=as_int(d["rookie_year"]),
+        active_years=d["active_years"],
+    )
+
+
+def decode_team_event_epa(d: Optional[Dict]) -> Optional[TeamEventEPA]:
+    if d is None:
+        return None
+
+    return TeamEventEPA(
+        mean=as_float(d["mean"]),
+        sd=as_float(d["sd"]),
+        start=as_float(d["start"]),
+        normalized=as_int(d["normalized"]),
+    )
+
+
+def decode_team_event(d: Dict) -> TeamEvent:
+    return TeamEvent(
+        team_key=d["team_key"],
+        event_key=d["event_key"],
+        event_type=EventType(d["event_type"]),
+        event_week=as_int(d["event_week"]),
+        award_only_appearance=d["award_only_appearance"],
+        qual_pts=as_int(d["qual_pts"]),
+        alliance_pts=as_int(d["alliance_pts"]),
+        elim_pts=as_int(d["elim_pts"]),
+        award_pts=as_int(d["award_pts"]),
+        total_pts=as_int(d["total_pts"]),
+        awards_received=[AwardType(a) for a in d["awards_received"]],
+        qual_record=decode_record(d["qual_record"]),
+        elim_record=decode_record(d["elim_record"]),
+        total_record=decode_record(d["total_record"]),
+        match_keys=d["match_keys"],
+        epa=decode_team_event_epa(d["epa"]),
+    )
+
+
+def decode_annual_slots(d: Dict) -> AnnualSlots:
+    return AnnualSlots(
+        total=as_int(d["total"]),
+        impact=as_int(d["impact"]),
+        ei=as_int(d["ei"]),
+        ras=as_int(d["ras"]),
+        dlf=as_int(d["dlf"]),
+        wffa=as_int(d["wffa"]),
+    )
+
+
+def decode_award(d: Dict) -> Award:
+    return Award(
+        award_type=AwardType(d["award_type"]), recipient_team=d["recipient_team"]
+    )
+
+
+def decode_alliance(d: Dict) -> Alliance:
+    return Alliance(
+        teams=d["teams"],
+        captain=d["captain"],
+        first_pick=d["first_pick"],
+        second_pick=d["second_pick"],
+        backup=d["backup"],
+        placement=AlliancePlacement(d["placement"]),
+    )
+
+
+def decode_event(d: Dict) -> Event:
+    return Event(
+        key=d["key"],
+        start_date=d["start_date"],
+        end_date=d["end_date"],
+        code=d["code"],
+        name=d["name"],
+        short_name=d["short_name"],
+        city=d["city"],
+        state_prov=d["state_prov"],
+        country=d["country"],
+        week=as_int(d["week"]),
+        year=as_int(d["year"]),
+        event_type=EventType(d["event_type"]),
+        parent_key=d["parent_key"],
+        child_keys=d["child_keys"],
+        awards=[decode_award(a) for a in d["awards"]],
+        district_pts=d["district_pts"],
+        matches=d["matches"],
+        alliances=[decode_alliance(a) for a in d["alliances"]],
+        rankings=d["rankings"],
+    )
+
+
+def decode_district_ranking(d: Dict) -> DistrictRanking:
+    return DistrictRanking(
+        qualifying_points_individual=d["qualifying_points_individual"],
+        qualifying_points_total=as_int(d["qualifying_points_total"]),
+        dcmp_points=as_int(d["dcmp_points"]),
+        rank=as_int(d["rank"]),
+        age_bonus=as_int(d["age_bonus"]),
+        team_key=d["team_key"],
+    )
+
+
+def decode_annual_info(d: Dict) -> AnnualInfo:
+    return AnnualInfo(
+        year=as_int(d["year"]),
+        team_keys=d["team_keys"],
+        team_events={
+            tk: [decode_team_event(te) for te in tes]
+            for tk, tes in d["team_events"].items()
+        },
+        slots=decode_annual_slots(d["slots"]),
+        events=[decode_event(e) for e in d["events"]],
+        rankings=[decode_district_ranking(r) for r in d["rankings"]],
+    )
+
+
+def decode_district_summary(d: Dict) -> DistrictSummary:
+    return DistrictSummary(
+        all_teams={k: decode_simple_team(t) for k, t in d["all_teams"].items()},
+        key=d["key"],
+        name=d["name"],
+        first_year=as_int(d["first_year"]),
+        teams_by_year={
+            int(year): tks for year, tks in d.get("teams_by_year", {}).items()
+        },
+    )
+
+
+def decode_district_info(d: Dict) -> DistrictInfo:
+    return DistrictInfo(
+        summary=decode_district_summary(d["summary"]),
+        annual_info={
+            int(year): decode_annual_info(ai) for year, ai in d["annual_info"].items()
+        },
+    )
+
+
+def loads(raw: bytes) -> Any:
+    # orjson rejects the NaN / Infinity that json.dump writes for non-finite
+    # Statbotics floats; the standard library still reads those files.
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw)
+
+
+def load_district_info(path: str) -> DistrictInfo:
+    with open(path, "rb") as f:
+        return decode_district_info(loads(f.read()))
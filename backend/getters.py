@@ -1,19 +1,34 @@
 import asyncio
 import csv
-import itertools
+from contextlib import asynccontextmanager
+import hashlib
+import json
+import os
+import shutil
 from collections import defaultdict
-from typing import Any, Dict, List, Tuple, TypedDict, Union
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+)
 
 from aiohttp import TCPConnector
 from aiohttp_client_cache import CachedSession, SQLiteBackend
 
+import numpy as np
 import pandas as pd
 
-from tbapy import TBA
-
 from api_types import (
     Alliance,
     Award,
+    AwardType,
     Event,
     EventType,
     Record,
@@ -23,9 +38,9 @@ from api_types import (
     DoubleElimRound,
     AlliancePlacement,
 )
+from util import CURRENT_YEAR
 
 KEY = "1EhUOwczJi4vDUXza94fAo7s4UFrKgBrTJ6A3MTeYR0WrgzlyGR0Tzyl1TN2P6Tu"
-tba = TBA(KEY)
 TBA_HEADERS: Dict[str, str] = {"X-TBA-Auth-Key": KEY}
 
 
@@ -50,18 +65,241 @@ class TBATeam(TypedDict):
     website: Union[str, None]
 
 
+STATBOTICS_TEAM_EVENT_DTYPES: Dict[str, str] = {
+    "event": "category",
+    "team": "category",
+    "qual_wins": "Int16",
+    "qual_losses": "Int16",
+    "qual_ties": "Int16",
+    "wins": "Int16",
+    "losses": "Int16",
+    "ties": "Int16",
+    # EPA values are written to the output as-is, so keep them at full precision.
+    "epa_mean": "float64",
+    "epa_sd": "float64",
+    "epa_start": "float64",
+    "norm_epa": "Int16",
+}
+
+
+STATBOTICS_DIR = "data/statbotics"
+STATBOTICS_CACHE_DIR = "data/statbotics/cache"
+STATBOTICS_DTYPES: Dict[str, Dict[str, str]] = {
+    "team_events.csv": STATBOTICS_TEAM_EVENT_DTYPES,
+}
+
+MASKED_ARRAY_TYPES = {
+    "i": pd.arrays.IntegerArray,
+    "u": pd.arrays.IntegerArray,
+    "f": pd.arrays.FloatingArray,
+    "b": pd.arrays.BooleanArray,
+}
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def statbotics_cache_path(filename: str, digest: str) -> str:
+    return os.path.join(
+        STATBOTICS_CACHE_DIR, f"{filename.removesuffix('.csv')}-{digest[:16]}"
+    )
+
+
+def build_statbotics_cache(filename: str) -> str:
+    digest = file_hash(os.path.join(STATBOTICS_DIR, filename))
+    path = statbotics_cache_path(filename, digest)
+    if os.path.isdir(path):
+        return path
+
+    df = pd.read_csv(
+        os.path.join(STATBOTICS_DIR, filename),
+        dtype=STATBOTICS_DTYPES.get(filename),
+        low_memory=False,
+    )
+
+    # Only one cache per source file is kept; older hashes are stale.
+    stem = filename.removesuffix(".csv")
+    if os.path.isdir(STATBOTICS_CACHE_DIR):
+        for old in os.listdir(STATBOTICS_CACHE_DIR):
+            if old.rsplit("-", 1)[0] == stem:
+                shutil.rmtree(os.path.join(STATBOTICS_CACHE_DIR, old))
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(tmp_path)
+
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object:
+            series = series.astype("category")
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_path, f"{col}.npy"), series.cat.codes.to_numpy())
+            columns[col] = {
+                "kind": "category",
+                "categories": [str(c) for c in series.cat.categories],
+            }
+        elif pd.api.types.is_extension_array_dtype(series.dtype):
+            numpy_dtype = series.dtype.numpy_dtype
+            np.save(
+                os.path.join(tmp_path, f"{col}.npy"),
+                series.to_numpy(dtype=numpy_dtype, na_value=numpy_dtype.type(0)),
+            )
+            np.save(os.path.join(tmp_path, f"{col}.mask.npy"), series.isna().to_numpy())
+            columns[col] = {"kind": "masked"}
+        else:
+            np.save(os.path.join(tmp_path, f"{col}.npy"), series.to_numpy())
+            columns[col] = {"kind": "numpy"}
+
+    with open(os.path.join(tmp_path, "columns.json"), "w+") as f:
+        json.dump({"source": filename, "sha256": digest, "columns": columns}, f)
+
+    os.rename(tmp_path, path)
+    return path
+
+
+def read_statbotics(filename: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    path = build_statbotics_cache(filename)
+    with open(os.path.join(path, "columns.json"), "r") as f:
+        header = json.load(f)
+        meta = header["columns"]
+
+    data = {}
+    for col in columns or list(meta.keys()):
+        values = np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")
+        if meta[col]["kind"] == "category":
+            data[col] = pd.Categorical.from_codes(
+                values, categories=meta[col]["categories"]
+            )
+        elif meta[col]["kind"] == "masked":
+            mask = np.load(os.path.join(path, f"{col}.mask.npy"), mmap_mode="r")
+            data[col] = MASKED_ARRAY_TYPES[values.dtype.kind](values, mask)
+        else:
+            data[col] = values
+
+    df = pd.DataFrame(data, copy=False)
+    df.attrs["sha256"] = header["sha256"]
+    return df
+
+
+class StatboticsTeamEvents:
+    _instance: Optional["StatboticsTeamEvents"] = None
+
+    df: pd.DataFrame
+    index: Dict[Tuple[str, str], int]
+    digest: Optional[str]
+    nullable: List[str]
+
+    def __init__(self, df: pd.DataFrame, digest: Optional[str] = None) -> None:
+        self.df = df
+        self.digest = digest
+        self.nullable = [
+            col
+            for col, dtype in df.dtypes.items()
+            if isinstance(dtype, pd.api.extensions.ExtensionDtype)
+            and not isinstance(dtype, pd.CategoricalDtype)
+        ]
+        self.index = {}
+        for i, (ek, team) in enumerate(zip(df["event"], df["team"])):
+            # Keep the first row for a pair, matching the old `.iloc[0]` lookup.
+            self.index.setdefault((ek, str(team)), i)
+
+    @classmethod
+    def load(cls, years: Optional[Set[int]] = None) -> "StatboticsTeamEvents":
+        df = read_statbotics(
+            "team_events.csv", columns=list(STATBOTICS_TEAM_EVENT_DTYPES.keys())
+        )
+        digest = df.attrs["sha256"]
+
+        if years is not None:
+            event_years = df["event"].cat.categories.str[:4].astype(int)
+            kept_events = df["event"].cat.categories[event_years.isin(years)]
+            df = df[df["event"].isin(kept_events)]
+
+        cls._instance = cls(df, digest=digest)
+        return cls._instance
+
+    @classmethod
+    def get(cls) -> "StatboticsTeamEvents":
+        if cls._instance is None:
+            cls.load()
+
+        return cls._instance
+
+    def lookup(self, event_key: str, team_key: str) -> Optional[pd.Series]:
+        i = self.index.get((event_key, team_key[3:]))
+        if i is None:
+            return None
+
+        row = self.df.iloc[i]
+        # Missing values in the nullable integer columns come back as pd.NA,
+        # which can't be written out as JSON.
+        missing = [col for col in self.nullable if row[col] is pd.NA]
+        if missing:
+            row = row.copy()
+            row[missing] = None
+
+        return row
+
+
+# Cached responses for past seasons are used forever. Anything that can still
+# change is revalidated with a conditional request (If-None-Match /
+# If-Modified-Since) once its cached copy is older than its TTL; a 304 keeps
+# the cached body and restarts its TTL. Responses with neither validator are
+# simply fetched again.
+CURRENT_SEASON_TTL = timedelta(minutes=10)
+UNDATED_TTL = timedelta(days=1)
+
+
+def tba_ttl(url: str) -> Optional[timedelta]:
+    # e.g. event/2024incmp, district/2024fin/rankings, events/2024/simple
+    segments = url.removeprefix(tba_url("")).split("/")
+    if len(segments) < 2 or not segments[1][:4].isdigit():
+        return UNDATED_TTL
+
+    return None if int(segments[1][:4]) < CURRENT_YEAR else CURRENT_SEASON_TTL
+
+
 async def fetch_json(session: CachedSession, url: str) -> Any:
-    async with session.get(url, headers=TBA_HEADERS) as response:
-        return await response.json()
+    ttl = tba_ttl(url)
+    key = session.cache.create_key("GET", url, headers=TBA_HEADERS)
+    cached = None if ttl is None else await session.cache.get_response(key)
+    stale = cached is not None and datetime.utcnow() - cached.created_at > ttl
+
+    revalidate = stale and (
+        "ETag" in cached.headers or "Last-Modified" in cached.headers
+    )
+    if stale and not revalidate:
+        await session.cache.delete(key)
 
+    async with session.get(url, headers=TBA_HEADERS, refresh=revalidate) as response:
+        data = await response.json()
 
-async def fetch_all(urls: List[str]) -> List[Any]:
-    connector = TCPConnector(limit=32)
+        # aiohttp-client-cache hands back the cached copy on a 304 without saving
+        # it again, so its age would keep growing and every later call would
+        # revalidate.
+        if revalidate and response.from_cache:
+            response.created_at = datetime.utcnow()
+            await session.cache.responses.write(key, response)
+
+        return data
+
+
+@asynccontextmanager
+async def tba_session(limit: int = 32) -> AsyncIterator[CachedSession]:
+    # One pooled session per CLI command: keep-alive connections and cached DNS
+    # avoid a TLS handshake and a SQLite open for every batch of requests.
+    connector = TCPConnector(limit=limit, ttl_dns_cache=600, keepalive_timeout=60)
     async with CachedSession(
         connector=connector, cache=SQLiteBackend("cache")
     ) as session:
-        tasks = [fetch_json(session, url) for url in urls]
-        return await asyncio.gather(*tasks)
+        yield session
+
+
+async def fetch_all(session: CachedSession, urls: List[str]) -> List[Any]:
+    return await asyncio.gather(*[fetch_json(session, url) for url in urls])
 
 
 def flatten(l: List[List]) -> List:
@@ -72,96 +310,144 @@ def tba_url(endpoint: str) -> str:
     return f"https://www.thebluealliance.com/api/v3/{endpoint}"
 
 
-async def get_all_teams(year: int) -> List[TBATeam]:
+async def get_all_teams(session: CachedSession, year: int) -> List[TBATeam]:
     return flatten(
-        await fetch_all([tba_url(f"teams/{year}/{x}") for x in range(0, 20)])
+        await fetch_all(session, [tba_url(f"teams/{year}/{x}") for x in range(0, 20)])
     )
 
 
-async def get_event_teams_keys(keys: List[str]) -> Dict[str, List[str]]:
-    l = await fetch_all([tba_url(f"event/{k}/teams/keys") for k in keys])
+async def get_events(session: CachedSession, year: int) -> List[Dict]:
+    return (await fetch_all(session, [tba_url(f"events/{year}/simple")]))[0]
+
+
+async def get_event_teams_keys(
+    session: CachedSession, keys: List[str]
+) -> Dict[str, List[str]]:
+    l = await fetch_all(session, [tba_url(f"event/{k}/teams/keys") for k in keys])
     return dict(zip(keys, l))
 
 
-async def get_all_teams_by_keys(keys: List[str]) -> Dict[str, TBATeam]:
-    return dict(zip(keys, await fetch_all([tba_url(f"team/{k}") for k in keys])))
+async def get_all_teams_by_keys(
+    session: CachedSession, keys: List[str]
+) -> Dict[str, TBATeam]:
+    return dict(
+        zip(keys, await fetch_all(session, [tba_url(f"team/{k}") for k in keys]))
+    )
 
 
-async def get_district_rankings(district_key: str, year: int) -> List[Dict]:
-    return (await fetch_all([tba_url(f"district/{year}{district_key}/rankings")]))[0]
+async def get_district_rankings(
+    session: CachedSession, district_key: str, year: int
+) -> List[Dict]:
+    return (
+        await fetch_all(session, [tba_url(f"district/{year}{district_key}/rankings")])
+    )[0]
 
 
-async def get_team_events(
-    team_keys: List[str], event_keys: List[str], pbar_maker=None
-) -> Tuple[Dict[str, List[TeamEvent]], List[Event]]:
-    statbotics_team_events = pd.read_csv("data/statbotics/team_events.csv")
+EVENT_ENDPOINTS: Dict[str, str] = {
+    "infos": "event/{}",
+    "statuses": "event/{}/teams/statuses",
+    "dpts": "event/{}/district_points",
+    "matches": "event/{}/matches/simple",
+    "awards": "event/{}/awards",
+    "rankings": "event/{}/rankings",
+    "alliances": "event/{}/alliances",
+}
 
-    team_events = defaultdict(list)
 
-    event_infos = dict(
-        zip(event_keys, await fetch_all([tba_url(f"event/{k}") for k in event_keys]))
-    )
-    event_statuses = dict(
-        zip(
-            event_keys,
-            await fetch_all([tba_url(f"event/{k}/teams/statuses") for k in event_keys]),
-        )
-    )
-    event_dpts = dict(
-        zip(
-            event_keys,
-            await fetch_all(
-                [tba_url(f"event/{k}/district_points") for k in event_keys]
-            ),
-        )
-    )
-    event_matches = dict(
-        zip(
-            event_keys,
-            await fetch_all([tba_url(f"event/{k}/matches/simple") for k in event_keys]),
-        )
-    )
-    event_awards = dict(
-        zip(
-            event_keys,
-            await fetch_all([tba_url(f"event/{k}/awards") for k in event_keys]),
-        )
-    )
-    event_rankings = dict(
-        zip(
-            event_keys,
-            await fetch_all([tba_url(f"event/{k}/rankings") for k in event_keys]),
-        )
-    )
-    event_alliances = dict(
-        zip(
-            event_keys,
-            await fetch_all([tba_url(f"event/{k}/alliances") for k in event_keys]),
+async def get_event_payloads(
+    session: CachedSession, event_keys: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    payloads: Dict[str, Dict[str, Any]] = {name: {} for name in EVENT_ENDPOINTS}
+
+    async def fetch_into(name: str, event_key: str):
+        payloads[name][event_key] = await fetch_json(
+            session, tba_url(EVENT_ENDPOINTS[name].format(event_key))
         )
+
+    # Every endpoint of every event goes out in one wave, so a slow response
+    # only holds up its own slot instead of the next endpoint's whole batch.
+    await asyncio.gather(
+        *[fetch_into(name, ek) for name in EVENT_ENDPOINTS for ek in event_keys]
     )
+    return payloads
+
 
-    team_event_combos = itertools.product(team_keys, event_keys)
-    iterable = (
-        team_event_combos if pbar_maker is None else pbar_maker(list(team_event_combos))
+async def get_team_events(
+    session: CachedSession,
+    team_keys: List[str],
+    event_keys: List[str],
+    pbar_maker=None,
+) -> Tuple[Dict[str, List[TeamEvent]], List[Event]]:
+    return build_team_events(
+        team_keys,
+        event_keys,
+        await get_event_payloads(session, event_keys),
+        pbar_maker=pbar_maker,
     )
+
+
+def index_match_keys(matches: List[Dict]) -> Dict[str, List[str]]:
+    match_keys = defaultdict(list)
+    for m in matches:
+        for tk in dict.fromkeys(
+            m["alliances"]["blue"]["team_keys"] + m["alliances"]["red"]["team_keys"]
+        ):
+            match_keys[tk].append(m["key"])
+
+    return dict(match_keys)
+
+
+def index_award_types(awards: List[Dict]) -> Dict[str, List[AwardType]]:
+    award_types = defaultdict(list)
+    for award in awards:
+        for tk in dict.fromkeys(r["team_key"] for r in award["recipient_list"]):
+            award_types[tk].append(award["award_type"])
+
+    return dict(award_types)
+
+
+def build_team_events(
+    team_keys: List[str],
+    event_keys: List[str],
+    payloads: Dict[str, Dict[str, Any]],
+    pbar_maker=None,
+) -> Tuple[Dict[str, List[TeamEvent]], List[Event]]:
+    statbotics_team_events = StatboticsTeamEvents.get()
+
+    team_events = defaultdict(list)
+
+    event_infos = payloads["infos"]
+    event_statuses = payloads["statuses"]
+    event_dpts = payloads["dpts"]
+    event_matches = payloads["matches"]
+    event_awards = payloads["awards"]
+    event_rankings = payloads["rankings"]
+    event_alliances = payloads["alliances"]
+
+    event_team_matches = {ek: index_match_keys(event_matches[ek]) for ek in event_keys}
+    event_team_awards = {ek: index_award_types(event_awards[ek]) for ek in event_keys}
+
+    # Only walk teams that actually have a status at each event rather than
+    # every district team against every event.
+    district_team_keys = set(team_keys)
+    participations = [
+        (tk, ek)
+        for ek in event_keys
+        for tk in event_statuses[ek]
+        if tk in district_team_keys and tk in event_dpts[ek]["points"]
+    ]
+    iterable = participations if pbar_maker is None else pbar_maker(participations)
     for tk, ek in iterable:
         if pbar_maker is not None:
-            iterable.set_description(f"{tk[3:].rjust(4)} @ {ek.ljust(10)}")
-
-        if tk not in event_statuses[ek] or tk not in event_dpts[ek]["points"]:
-            continue
+            iterable.set_description(
+                f"{tk[3:].rjust(4)} @ {ek.ljust(10)}", refresh=False
+            )
 
         award_only = event_statuses[ek][tk]["last_match_key"] is None
 
         epa_data = None
         if not award_only:
-            maybe_sb_data = statbotics_team_events[
-                (statbotics_team_events["event"] == ek)
-                & (statbotics_team_events["team"] == tk[3:])
-            ]
-
-            if not maybe_sb_data.empty:
-                epa_data = maybe_sb_data.iloc[0]
+            epa_data = statbotics_team_events.lookup(ek, tk)
 
         if epa_data is None and not award_only:
             continue
@@ -214,25 +500,11 @@ async def get_team_events(
                 elim_pts=event_dpts[ek]["points"][tk]["elim_points"],
                 award_pts=event_dpts[ek]["points"][tk]["award_points"],
                 total_pts=event_dpts[ek]["points"][tk]["total"],
-                awards_received=[
-                    award["award_type"]
-                    for award in event_awards[ek]
-                    if any(
-                        recipient["team_key"] == tk
-                        for recipient in award["recipient_list"]
-                    )
-                ],
+                awards_received=event_team_awards[ek].get(tk, []),
                 qual_record=qual_record,
                 elim_record=elim_record,
                 total_record=total_record,
-                match_keys=[
-                    m["key"]
-                    for m in event_matches[ek]
-                    if (
-                        tk in m["alliances"]["blue"]["team_keys"]
-                        or tk in m["alliances"]["red"]["team_keys"]
-                    )
-                ],
+                match_keys=event_team_matches[ek].get(tk, []),
                 epa=(
                     None
                     if epa_data is None
@@ -366,4 +638,5 @@ async def get_team_events(
             )
         )
 
-    return dict(team_events), events
+    # Keep teams in district order, as iterating team_keys used to.
+    return {tk: team_events[tk] for tk in team_keys if tk in team_events}, events
@@ -1,26 +1,61 @@
+import asyncio
 import dataclasses
+import hashlib
 import json
+import os
+import shutil
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from dataclasses import dataclass
-from pathlib import Path
-from typing import Dict, List, Set
+from typing import Dict, List, Set, Tuple
+
+from aiohttp_client_cache import CachedSession
 
 from api_types import (
     AnnualInfo,
     AnnualSlots,
-    DistrictInfo,
     DistrictSummary,
     SimpleTeam,
     DistrictRanking,
 )
-from getters import get_all_teams_by_keys, get_team_events, tba, get_district_rankings
+from getters import (
+    StatboticsTeamEvents,
+    build_team_events,
+    get_all_teams_by_keys,
+    get_event_payloads,
+    get_events,
+    get_district_rankings,
+)
 from numpyencoder import NumpyEncoder
 from tqdm import tqdm
 from yaml import Loader, load
-from util import us_state_to_abbrev, can_province_abbrev
+from util import (
+    us_state_to_abbrev,
+    can_province_abbrev,
+    district_years,
+    indented_json,
+    read_district_data,
+    write_district_data,
+)
 
 CURRENT_YEAR = 2024
+# Bump whenever the way an AnnualInfo is built from its inputs changes, so
+# every year is rebuilt instead of reused from the previous output.
+MANIFEST_VERSION = 2
+
+
+def year_fingerprint(*inputs) -> str:
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, cls=NumpyEncoder).encode()
+    ).hexdigest()
+
+
+def year_fragment_path(district_key: str, year: int) -> str:
+    return f"data/out/{district_key}/years/{year}.json"
+
+
+def team_keys_from_rankings(district_rankings: List[Dict]) -> List[str]:
+    return sorted([r["team_key"] for r in district_rankings], key=lambda k: int(k[3:]))
 
 
 class District(ABC):
@@ -42,11 +77,11 @@ class District(ABC):
         self.name = name
 
     @abstractmethod
-    async def get_team_keys(self, year: int) -> List[str]:
+    async def get_team_keys(self, year: int, session: CachedSession) -> List[str]:
         pass
 
     @abstractmethod
-    async def get_event_keys(self, year: int) -> List[str]:
+    async def get_event_keys(self, year: int, session: CachedSession) -> List[str]:
         pass
 
 
@@ -60,23 +95,21 @@ class RealDistrict(District):
     ) -> None:
         super().__init__(district_key, first_year, slots, name)
 
-    async def get_event_keys(self, year: int) -> List[str]:
+    async def get_event_keys(self, year: int, session: CachedSession) -> List[str]:
         return [
             e["key"]
-            for e in tba.events(year=year)
+            for e in await RealDistricts.get_events(year, session)
             if (
                 e["district"] is not None
                 and e["district"]["abbreviation"] == self.district_key
             )
         ]
 
-    async def get_team_keys(self, year: int) -> List[str]:
-        return sorted(
-            [
-                r["team_key"]
-                for r in tba.district_rankings(district=f"{year}{self.district_key}")
-            ],
-            key=lambda k: int(k[3:]),
+    async def get_team_keys(self, year: int, session: CachedSession) -> List[str]:
+        return team_keys_from_rankings(
+            await get_district_rankings(
+                session, district_key=self.district_key, year=year
+            )
         )
 
 
@@ -93,6 +126,16 @@ class FakeDistrict(District):
 
 class RealDistricts:
     ALL: List[RealDistrict] = []
+    # Every district filters the same season's event list, so fetch it once per
+    # year and let concurrent callers await the same task.
+    EVENTS: Dict[int, asyncio.Task] = {}
+
+    @classmethod
+    def get_events(cls, year: int, session: CachedSession) -> asyncio.Task:
+        if year not in cls.EVENTS:
+            cls.EVENTS[year] = asyncio.create_task(get_events(session, year))
+
+        return cls.EVENTS[year]
 
     @classmethod
     def load(cls):
@@ -119,117 +162,218 @@ class RealDistricts:
                 )
 
     @classmethod
-    async def generate_annual_infos(cls):
-        district_infos: Dict[str, DistrictInfo] = {}
-
-        for rd in (pb1 := tqdm(cls.ALL, position=0, leave=False)):
-            all_teams: Set[str] = set()
-            annual_infos: Dict[int, AnnualInfo] = {}
-            active_years = defaultdict(list)
-
-            pb1.set_description(rd.district_key.rjust(3))
-            for year in (
-                pb2 := tqdm(
-                    [
-                        y
-                        for y in range(rd.first_year, CURRENT_YEAR + 1)
-                        if y not in [2020, 2021]
-                    ],
-                    position=1,
-                    leave=False,
-                )
+    async def generate_annual_info(
+        cls,
+        rd: RealDistrict,
+        year: int,
+        session: CachedSession,
+        semaphore: asyncio.Semaphore,
+        previous: Dict[int, Dict],
+        pbar_maker=None,
+    ) -> Dict:
+        async with semaphore:
+            # The team keys come from the same rankings, so fetch them once.
+            district_rankings = await get_district_rankings(
+                session, district_key=rd.district_key, year=year
+            )
+            tks = team_keys_from_rankings(district_rankings)
+            eks = await rd.get_event_keys(year=year, session=session)
+            payloads = await get_event_payloads(session, eks)
+            slots = rd.slots.get(
+                year, AnnualSlots(total=0, impact=0, ei=0, ras=0, dlf=0, wffa=0)
+            )
+
+            fingerprint = year_fingerprint(
+                tks,
+                eks,
+                district_rankings,
+                payloads,
+                dataclasses.asdict(slots),
+                StatboticsTeamEvents.get().digest,
+            )
+            if (
+                year in previous
+                and previous[year]["fingerprint"] == fingerprint
+                and os.path.exists(year_fragment_path(rd.district_key, year))
             ):
-                pb2.set_description(str(year))
-                tks = await rd.get_team_keys(year=year)
-                eks = await rd.get_event_keys(year=year)
-
-                team_events, events = await get_team_events(
-                    team_keys=tks,
-                    event_keys=eks,
-                    pbar_maker=lambda l: tqdm(l, position=2, leave=False),
+                return previous[year]
+
+            team_events, events = build_team_events(
+                team_keys=tks,
+                event_keys=eks,
+                payloads=payloads,
+                pbar_maker=pbar_maker,
+            )
+
+            ai = AnnualInfo(
+                year=year,
+                team_keys=list(team_events.keys()),
+                team_events=team_events,
+                slots=slots,
+                events=events,
+                rankings=[
+                    DistrictRanking(
+                        qualifying_points_individual=[
+                            e["total"]
+                            for e in r["event_points"]
+                            if not e["district_cmp"]
+                        ],
+                        qualifying_points_total=sum(
+                            e["total"]
+                            for e in r["event_points"]
+                            if not e["district_cmp"]
+                        ),
+                        dcmp_points=sum(
+                            e["total"] for e in r["event_points"] if e["district_cmp"]
+                        ),
+                        rank=r["rank"],
+                        age_bonus=r["rookie_bonus"],
+                        team_key=r["team_key"],
+                    )
+                    for r in district_rankings
+                    if (r["point_total"] - r["rookie_bonus"]) > 0
+                ],
+            )
+
+            # Written out straight away so the year can be dropped from memory;
+            # annual_info.json is stitched together from these at the end.
+            write_district_data(
+                rd.district_key, f"years/{year}.json", indented_json(ai, depth=2)
+            )
+
+            return {"fingerprint": fingerprint, "team_keys": ai.team_keys}
+
+    @classmethod
+    def previous_manifest(cls, rd: RealDistrict) -> Dict[int, Dict]:
+        try:
+            manifest = read_district_data(rd.district_key, "manifest.json")
+        except FileNotFoundError:
+            return {}
+
+        if manifest["version"] != MANIFEST_VERSION:
+            return {}
+
+        return {int(year): entry for year, entry in manifest["years"].items()}
+
+    @classmethod
+    async def generate_district_info(
+        cls,
+        rd: RealDistrict,
+        session: CachedSession,
+        semaphore: asyncio.Semaphore,
+        pbar: tqdm,
+        pbar_maker=None,
+        full: bool = False,
+    ) -> Tuple[DistrictSummary, Dict[int, Dict]]:
+        previous = {} if full else cls.previous_manifest(rd)
+
+        async def generate_year(year: int) -> Dict:
+            entry = await cls.generate_annual_info(
+                rd, year, session, semaphore, previous, pbar_maker=pbar_maker
+            )
+            pbar.set_description(f"{rd.district_key.rjust(3)} {year}")
+            pbar.update()
+            return entry
+
+        years = district_years(rd.first_year)
+        manifest = dict(
+            zip(years, await asyncio.gather(*[generate_year(y) for y in years]))
+        )
+
+        all_teams: Set[str] = set()
+        active_years = defaultdict(list)
+        for year, entry in manifest.items():
+            all_teams.update(entry["team_keys"])
+            for k in entry["team_keys"]:
+                active_years[k].append(year)
+
+        team_infos = await get_all_teams_by_keys(session, list(all_teams))
+
+        summary = DistrictSummary(
+            all_teams={
+                k: SimpleTeam(
+                    key=k,
+                    number=int(k[3:]),
+                    city=t["city"],
+                    state_prov={
+                        "USA": us_state_to_abbrev,
+                        "Canada": can_province_abbrev,
+                    }
+                    .get(t["country"], {})
+                    .get(t["state_prov"], t["state_prov"]),
+                    country=t["country"],
+                    name=t["nickname"],
+                    rookie_year=t["rookie_year"],
+                    active_years=active_years[k],
                 )
+                for k, t in team_infos.items()
+            },
+            first_year=rd.first_year,
+            key=rd.district_key,
+            name=rd.name,
+        )
+        return summary, manifest
 
-                all_teams.update(team_events.keys())
-                for k in team_events.keys():
-                    active_years[k].append(year)
+    @classmethod
+    def write_district_info(
+        cls, rd: RealDistrict, summary: DistrictSummary, years: List[int]
+    ):
+        # Produces the same text as json.dump(dataclasses.asdict(DistrictInfo),
+        # indent=2, sort_keys=True) without holding every year in memory.
+        path = f"data/out/{rd.district_key}/annual_info.json"
+        with open(f"{path}.tmp", "w+") as f:
+            f.write('{\n  "annual_info": {')
+            for i, year in enumerate(sorted(years)):
+                f.write(f'{"," if i else ""}\n    "{year}": ')
+                with open(year_fragment_path(rd.district_key, year), "r") as fragment:
+                    shutil.copyfileobj(fragment, f)
+            f.write('\n  },\n  "summary": ')
+            f.write(indented_json(summary, depth=1))
+            f.write("\n}")
 
-                ai = AnnualInfo(
-                    year=year,
-                    team_keys=list(team_events.keys()),
-                    team_events=team_events,
-                    slots=rd.slots.get(
-                        year, AnnualSlots(total=0, impact=0, ei=0, ras=0, dlf=0, wffa=0)
-                    ),
-                    events=events,
-                    rankings=[
-                        DistrictRanking(
-                            qualifying_points_individual=[
-                                e["total"]
-                                for e in r["event_points"]
-                                if not e["district_cmp"]
-                            ],
-                            qualifying_points_total=sum(
-                                e["total"]
-                                for e in r["event_points"]
-                                if not e["district_cmp"]
-                            ),
-                            dcmp_points=sum(
-                                e["total"]
-                                for e in r["event_points"]
-                                if e["district_cmp"]
-                            ),
-                            rank=r["rank"],
-                            age_bonus=r["rookie_bonus"],
-                            team_key=r["team_key"],
-                        )
-                        for r in (
-                            await get_district_rankings(
-                                district_key=rd.district_key, year=year
-                            )
-                        )
-                        if (r["point_total"] - r["rookie_bonus"]) > 0
-                    ],
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    async def generate_annual_infos(
+        cls, session: CachedSession, concurrency: int = 1, full: bool = False
+    ):
+        StatboticsTeamEvents.load(
+            years={y for rd in cls.ALL for y in district_years(rd.first_year)}
+        )
+
+        # With a single worker the per-year team-event bar can sit under the
+        # overall one; concurrent years would fight over the same line.
+        pbar_maker = (
+            (lambda l: tqdm(l, position=1, leave=False)) if concurrency == 1 else None
+        )
+
+        cls.EVENTS = {}
+        semaphore = asyncio.Semaphore(concurrency)
+        with tqdm(
+            total=sum(len(district_years(rd.first_year)) for rd in cls.ALL),
+            position=0,
+            leave=False,
+        ) as pbar:
+
+            async def generate_district(rd: RealDistrict):
+                summary, manifest = await cls.generate_district_info(
+                    rd, session, semaphore, pbar, pbar_maker=pbar_maker, full=full
                 )
-                annual_infos[year] = ai
-
-            team_infos = await get_all_teams_by_keys(list(all_teams))
-
-            district_infos[rd.district_key] = DistrictInfo(
-                annual_info=annual_infos,
-                summary=DistrictSummary(
-                    all_teams={
-                        k: SimpleTeam(
-                            key=k,
-                            number=int(k[3:]),
-                            city=t["city"],
-                            state_prov={
-                                "USA": us_state_to_abbrev,
-                                "Canada": can_province_abbrev,
-                            }
-                            .get(t["country"], {})
-                            .get(t["state_prov"], t["state_prov"]),
-                            country=t["country"],
-                            name=t["nickname"],
-                            rookie_year=t["rookie_year"],
-                            active_years=active_years[k],
-                        )
-                        for k, t in team_infos.items()
-                    },
-                    first_year=rd.first_year,
-                    key=rd.district_key,
-                    name=rd.name,
-                ),
-            )
 
-            Path(f"data/out/{rd.district_key}/").mkdir(parents=True, exist_ok=True)
-            with open(f"data/out/{rd.district_key}/annual_info.json", "w+") as f:
-                json.dump(
-                    dataclasses.asdict(district_infos[rd.district_key]),
-                    f,
-                    indent=2,
-                    sort_keys=True,
-                    cls=NumpyEncoder,
+                cls.write_district_info(rd, summary, list(manifest.keys()))
+                write_district_data(
+                    rd.district_key,
+                    "manifest.json",
+                    json.dumps(
+                        {"version": MANIFEST_VERSION, "years": manifest},
+                        indent=2,
+                        sort_keys=True,
+                    ),
                 )
 
+            async with asyncio.TaskGroup() as tg:
+                for rd in cls.ALL:
+                    tg.create_task(generate_district(rd))
+
 
 RealDistricts.load()
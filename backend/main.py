@@ -1,16 +1,27 @@
 import asyncio
-import json
+import glob
 import os
+import time
 from asyncio import TaskGroup, run, sleep
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from functools import wraps
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 import click
+import uvicorn
 from aiohttp import ClientSession, TCPConnector
 from api import app
 from api_types import DistrictInfo
-from getters import get_all_teams
+from decoders import load_district_info, loads
+from getters import (
+    STATBOTICS_DIR,
+    build_statbotics_cache,
+    get_all_teams,
+    tba_session,
+)
 from impls import RealDistricts
+from packed import open_district_info, pack_district_info
 from tbapy import TBA
 from tqdm import tqdm
 
@@ -31,36 +42,135 @@ def cli():
 
 
 @cli.command()
+@click.option(
+    "--concurrency",
+    default=1,
+    show_default=True,
+    help="Number of district-years to build at the same time.",
+)
+@click.option(
+    "--limit",
+    default=32,
+    show_default=True,
+    help="Maximum number of open connections to TBA.",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Rebuild every year instead of only those whose inputs changed.",
+)
 @coro
-async def team_events():
-    # print(len(await get_all_teams(2024)))
-    # print(await fim.get_team_keys(2024))
-    # print(RealDistricts.ALL)
-    await RealDistricts.generate_annual_infos()
+async def team_events(concurrency: int, limit: int, full: bool):
+    async with tba_session(limit=limit) as session:
+        # print(len(await get_all_teams(session, 2024)))
+        # print(await fim.get_team_keys(2024, session))
+        # print(RealDistricts.ALL)
+        await RealDistricts.generate_annual_infos(
+            session, concurrency=concurrency, full=full
+        )
 
 
 @cli.command()
-def process_data():
-    process_fns = [
-        processors.process_district_index,
-    ]
+def statbotics_cache():
+    for filename in (pbar := tqdm(sorted(os.listdir(STATBOTICS_DIR)))):
+        if not filename.endswith(".csv"):
+            continue
 
+        pbar.set_description(filename)
+        build_statbotics_cache(filename)
+
+
+def load_annual_data(annual_infos_path: str) -> DistrictInfo:
+    # Prefer the packed copy from pack-data, unless annual_info.json was
+    # regenerated after it was written.
+    packed_path = annual_infos_path.removesuffix(".json") + ".msgpack"
+    if os.path.exists(packed_path) and os.path.getmtime(
+        packed_path
+    ) >= os.path.getmtime(annual_infos_path):
+        return open_district_info(packed_path)
+
+    return load_district_info(annual_infos_path)
+
+
+def process_district(
+    district_key: str, annual_infos_path: str, force: bool
+) -> Tuple[int, float, List[str]]:
+    start = time.perf_counter()
+    written = processors.run_processors(
+        district_key,
+        annual_infos_path,
+        lambda: load_annual_data(annual_infos_path),
+        force=force,
+    )
+    return os.getpid(), time.perf_counter() - start, written
+
+
+@cli.command()
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of processes to spread districts across.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Rewrite every output even if its inputs have not changed.",
+)
+def process_data(workers: int, force: bool):
     root_dir = "data/out/"
-    for subdir in (pbar := tqdm(os.listdir(root_dir))):
+    annual_infos_paths = {}
+    for subdir in os.listdir(root_dir):
         # if subdir != "ne":
         #     continue
 
-        subdir_path = os.path.join(root_dir, subdir)
-        pbar.set_description(f"{subdir}")
+        annual_infos_path = os.path.join(root_dir, subdir, "annual_info.json")
+        if os.path.exists(annual_infos_path):
+            annual_infos_paths[subdir] = annual_infos_path
+
+    timings: Dict[int, List[Tuple[str, float]]] = defaultdict(list)
+    skipped = []
+    # Districts are the unit of parallelism: each one computes its shared
+    # intermediates once in its own process and runs its outputs against them.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Biggest districts first so one doesn't start last and hold up the pool.
+        futures = {
+            pool.submit(process_district, subdir, path, force): subdir
+            for subdir, path in sorted(
+                annual_infos_paths.items(),
+                key=lambda item: os.path.getsize(item[1]),
+                reverse=True,
+            )
+        }
+        for future in (pbar := tqdm(as_completed(futures), total=len(futures))):
+            pbar.set_description(futures[future])
+            pid, seconds, written = future.result()
+            if written:
+                timings[pid].append((futures[future], seconds))
+            else:
+                skipped.append(futures[future])
+
+    for pid, districts in sorted(timings.items()):
+        click.echo(
+            f"worker {pid}: {sum(s for _, s in districts):.2f}s "
+            f"({', '.join(f'{d} {s:.2f}s' for d, s in districts)})"
+        )
+
+    if skipped:
+        click.echo(f"unchanged: {', '.join(sorted(skipped))}")
 
-        if os.path.isdir(subdir_path):
-            annual_infos_path = os.path.join(subdir_path, "annual_info.json")
-            if os.path.exists(annual_infos_path):
-                with open(annual_infos_path, "r") as file:
-                    annual_data: DistrictInfo = DistrictInfo.from_dict(json.load(file))
 
-                    for fn in tqdm(process_fns, position=1, leave=False):
-                        fn(annual_data)
+@cli.command()
+def pack_data():
+    for annual_infos_path in (
+        pbar := tqdm(sorted(glob.glob("data/out/*/annual_info.json")))
+    ):
+        pbar.set_description(annual_infos_path.split("/")[-2])
+        with open(annual_infos_path, "rb") as f:
+            pack_district_info(
+                loads(f.read()),
+                annual_infos_path.removesuffix(".json") + ".msgpack",
+            )
 
 
 @cli.command()
@@ -68,5 +178,12 @@ def api():
     app.run(debug=True)
 
 
+@cli.command()
+@click.option("--port", default=5000, show_default=True)
+@click.option("--workers", default=1, show_default=True)
+def asgi(port: int, workers: int):
+    uvicorn.run("asgi:app", port=port, workers=workers)
+
+
 if __name__ == "__main__":
     cli()
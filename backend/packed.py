@@ -0,0 +1,150 @@
+import mmap
+import struct
+from functools import cached_property
+from typing import Any, Dict, Iterator, List, Mapping, Tuple
+
+import msgpack
+import numpy as np
+
+from api_types import (
+    AnnualSlots,
+    DistrictInfo,
+    DistrictRanking,
+    Event,
+    TeamEvent,
+)
+from decoders import (
+    decode_annual_slots,
+    decode_district_ranking,
+    decode_district_summary,
+    decode_event,
+    decode_team_event,
+)
+
+# annual_info.msgpack layout:
+#   u32 (big endian)  length of the offset table
+#   offset table      msgpack {"summary": [offset, length],
+#                              "years": {year: {section: [offset, length]}}}
+#   blobs             one msgpack blob per summary / (year, section)
+# Offsets are relative to the end of the table, so a reader can seek straight to
+# the one year and section it needs.
+ANNUAL_INFO_SECTIONS = ["team_keys", "team_events", "slots", "events", "rankings"]
+HEADER = struct.Struct(">I")
+
+
+def pack_default(obj: Any) -> Any:
+    if isinstance(obj, np.generic):
+        return obj.item()
+
+    raise TypeError(f"Cannot pack {type(obj)}")
+
+
+def pack_district_info(data: Dict, path: str):
+    blobs: List[bytes] = []
+    offset = 0
+
+    def add(obj: Any) -> Tuple[int, int]:
+        nonlocal offset
+        blob = msgpack.packb(obj, default=pack_default)
+        blobs.append(blob)
+        offset += len(blob)
+        return offset - len(blob), len(blob)
+
+    table = {
+        "summary": add(data["summary"]),
+        "years": {
+            str(year): {section: add(ai[section]) for section in ANNUAL_INFO_SECTIONS}
+            for year, ai in data["annual_info"].items()
+        },
+    }
+
+    packed_table = msgpack.packb(table)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(len(packed_table)))
+        f.write(packed_table)
+        for blob in blobs:
+            f.write(blob)
+
+
+class PackedFile:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (table_length,) = HEADER.unpack_from(self.buffer, 0)
+        self.data_start = HEADER.size + table_length
+        self.table = msgpack.unpackb(
+            self.buffer[HEADER.size : self.data_start], strict_map_key=False
+        )
+
+    def read(self, location: Tuple[int, int]) -> Any:
+        offset, length = location
+        start = self.data_start + offset
+        return msgpack.unpackb(
+            memoryview(self.buffer)[start : start + length], strict_map_key=False
+        )
+
+
+class LazyAnnualInfo:
+    # Duck-types AnnualInfo; each section is only decoded the first time it is
+    # read.
+    def __init__(self, packed: PackedFile, year: int) -> None:
+        self.packed = packed
+        self.year = year
+        self.sections = packed.table["years"][str(year)]
+
+    @cached_property
+    def team_keys(self) -> List[str]:
+        return self.packed.read(self.sections["team_keys"])
+
+    @cached_property
+    def team_events(self) -> Dict[str, List[TeamEvent]]:
+        return {
+            tk: [decode_team_event(te) for te in tes]
+            for tk, tes in self.packed.read(self.sections["team_events"]).items()
+        }
+
+    @cached_property
+    def slots(self) -> AnnualSlots:
+        return decode_annual_slots(self.packed.read(self.sections["slots"]))
+
+    @cached_property
+    def events(self) -> List[Event]:
+        return [decode_event(e) for e in self.packed.read(self.sections["events"])]
+
+    @cached_property
+    def rankings(self) -> List[DistrictRanking]:
+        return [
+            decode_district_ranking(r)
+            for r in self.packed.read(self.sections["rankings"])
+        ]
+
+
+class LazyAnnualInfos(Mapping[int, LazyAnnualInfo]):
+    def __init__(self, packed: PackedFile) -> None:
+        self.packed = packed
+        self.years = [int(y) for y in packed.table["years"].keys()]
+        self.loaded: Dict[int, LazyAnnualInfo] = {}
+
+    def __getitem__(self, year: int) -> LazyAnnualInfo:
+        if year not in self.years:
+            raise KeyError(year)
+
+        if year not in self.loaded:
+            self.loaded[year] = LazyAnnualInfo(self.packed, year)
+
+        return self.loaded[year]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.years)
+
+    def __len__(self) -> int:
+        return len(self.years)
+
+
+def open_district_info(path: str) -> DistrictInfo:
+    packed = PackedFile(path)
+    return DistrictInfo(
+        summary=decode_district_summary(packed.read(packed.table["summary"])),
+        annual_info=LazyAnnualInfos(packed),
+    )
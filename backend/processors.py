@@ -1,69 +1,265 @@
 import dataclasses
+import hashlib
 import json
+import os
 from collections import Counter, defaultdict
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-from api_types import DistrictInfo, DistrictRanking, EventType, AlliancePlacement
-from util import Averager, avg, district_years, write_district_data
+import numpy as np
 
+from api_types import (
+    DistrictInfo,
+    DistrictRanking,
+    Event,
+    EventType,
+    AlliancePlacement,
+)
+from util import district_years, read_district_data, write_district_data
 
-def avg_nth_event(qualifying_points_individual: List[List[int]], n: int) -> int:
-    a = Averager()
+# Bump when outputs change for a reason the sources below don't show, e.g. a
+# library upgrade.
+PROCESSORS_VERSION = 1
+# This file, the types the steps use and the code that loads annual_info.
+SOURCE_FILES = ["processors.py", "api_types.py", "util.py", "decoders.py", "packed.py"]
 
-    for year in qualifying_points_individual:
-        if n < len(year):
-            a.feed(year[n])
 
-    return a.get()
+def sources_digest() -> bytes:
+    h = hashlib.sha256(str(PROCESSORS_VERSION).encode())
+    for name in SOURCE_FILES:
+        with open(os.path.join(os.path.dirname(__file__), name), "rb") as f:
+            h.update(hashlib.file_digest(f, "sha256").digest())
 
+    return h.digest()
 
-def process_district_index(info: DistrictInfo):
-    team_data = []
-    for tk, t in info.summary.all_teams.items():
-        obj = {
-            "team": dataclasses.asdict(t),
-            "record": {"wins": 0, "losses": 0, "ties": 0},
-            "dcmps": 0,
-            "epa": info.annual_info[t.active_years[-1]]
-            .team_events[t.key][-1]
-            .epa.normalized,
-            "avg_dpts": 0,
-        }
-
-        dpts_averager = Averager()
+
+SOURCES_DIGEST = sources_digest()
+
+
+@dataclass(frozen=True)
+class Step:
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...]
+
+
+# Named results shared by every output of a district. "info" is the loaded
+# DistrictInfo; everything else is registered with @intermediate.
+INTERMEDIATES: Dict[str, Step] = {}
+# Files written under data/out/<district>/, keyed by their relative path.
+OUTPUTS: Dict[str, Step] = {}
+
+
+def intermediate(name: str, *inputs: str):
+    def register(fn: Callable[..., Any]):
+        INTERMEDIATES[name] = Step(fn=fn, inputs=inputs)
+        return fn
+
+    return register
+
+
+def output(path: str, *inputs: str):
+    def register(fn: Callable[..., Any]):
+        OUTPUTS[path] = Step(fn=fn, inputs=inputs)
+        return fn
+
+    return register
+
+
+def mean(total: Union[int, float], count: int) -> Union[int, float]:
+    return total / count if count else 0
+
+
+class RankingAverager:
+    # Running sums of one team's district rankings across years, fed one
+    # ranking at a time. Seasons without qualifying points are left out of
+    # everything but the DCMP average.
+    __slots__ = (
+        "rankings",
+        "first_event",
+        "first_events",
+        "second_event",
+        "second_events",
+        "qualifying_points",
+        "qualifying_seasons",
+        "dcmp_points",
+        "dcmp_seasons",
+        "rank",
+        "ranked_seasons",
+    )
+
+    def __init__(self) -> None:
+        self.rankings = 0
+        self.first_event = self.first_events = 0
+        self.second_event = self.second_events = 0
+        self.qualifying_points = self.qualifying_seasons = 0
+        self.dcmp_points = self.dcmp_seasons = 0
+        self.rank = self.ranked_seasons = 0
+
+    def feed(self, r: DistrictRanking):
+        self.rankings += 1
+        if r.qualifying_points_total > 0:
+            events = r.qualifying_points_individual
+            if len(events) > 0:
+                self.first_event += events[0]
+                self.first_events += 1
+            if len(events) > 1:
+                self.second_event += events[1]
+                self.second_events += 1
+
+            self.qualifying_points += r.qualifying_points_total
+            self.qualifying_seasons += 1
+            if r.rank > 0:
+                self.rank += r.rank
+                self.ranked_seasons += 1
+
+        if r.dcmp_points > 0:
+            self.dcmp_points += r.dcmp_points
+            self.dcmp_seasons += 1
+
+    def get(self, team_key: str) -> DistrictRanking:
+        return DistrictRanking(
+            qualifying_points_individual=[
+                mean(self.first_event, self.first_events),
+                mean(self.second_event, self.second_events),
+            ],
+            qualifying_points_total=mean(
+                self.qualifying_points, self.qualifying_seasons
+            ),
+            dcmp_points=mean(self.dcmp_points, self.dcmp_seasons),
+            rank=mean(self.rank, self.ranked_seasons),
+            age_bonus=0,
+            team_key=team_key,
+        )
+
+
+DCMP_TYPES = [EventType.DISTRICT_CMP, EventType.DISTRICT_CMP_DIVISION]
+
+
+TEAM_EVENT_COLUMNS = [
+    "team",
+    "year",
+    "order",
+    "event_type",
+    "week",
+    "total_pts",
+    "has_record",
+    "won",
+    "lost",
+    "tied",
+]
+
+
+@intermediate("team_events", "info")
+def flatten_team_events(info: DistrictInfo) -> Dict[str, np.ndarray]:
+    # One row per team event across every active year. Teams are numbered in
+    # all_teams order, and `order` keeps each event's position in the team's
+    # list for that year.
+    rows = []
+    for team, (tk, t) in enumerate(info.summary.all_teams.items()):
         for y in t.active_years:
-            team_events = info.annual_info[y].team_events[t.key]
-            for te in team_events:
-                if te.total_record is not None:
-                    obj["record"]["wins"] += te.total_record.won
-                    obj["record"]["losses"] += te.total_record.lost
-                    obj["record"]["ties"] += te.total_record.tied
-
-            first_two_plays = [
-                te
-                for te in sorted(team_events, key=lambda x: x.event_week)
-                if te.event_type == EventType.DISTRICT
-            ][:2]
-
-            dpts_averager.feed_many([x.total_pts for x in first_two_plays])
-
-            if (
-                dcmp := next(
-                    filter(
-                        lambda te: te.event_type
-                        in [EventType.DISTRICT_CMP, EventType.DISTRICT_CMP_DIVISION],
-                        team_events,
-                    ),
-                    None,
+            for i, te in enumerate(info.annual_info[y].team_events[tk]):
+                record = te.total_record
+                rows.append(
+                    (
+                        team,
+                        y,
+                        i,
+                        te.event_type,
+                        -1 if te.event_week is None else te.event_week,
+                        te.total_pts,
+                    )
+                    + (
+                        (0, 0, 0, 0)
+                        if record is None
+                        else (1, record.won, record.lost, record.tied)
+                    )
                 )
-            ) is not None:
-                obj["dcmps"] += 1
 
-        obj["avg_dpts"] = dpts_averager.get()
-        team_data.append(obj)
+    table = np.array(rows, dtype=np.int64).reshape(-1, len(TEAM_EVENT_COLUMNS))
+    columns = dict(zip(TEAM_EVENT_COLUMNS, table.T))
+    columns["has_record"] = columns["has_record"].astype(bool)
+    return columns
+
+
+def group_sum(groups: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, groups, values)
+    return sums
+
+
+@intermediate("team_aggregates", "info", "team_events")
+def team_event_aggregates(
+    info: DistrictInfo, team_events: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    teams = len(info.summary.all_teams)
+    team = team_events["team"]
+    # (team, year) pairs as a single sortable key.
+    team_year = team * 10000 + team_events["year"]
+
+    with_record = team_events["has_record"]
+    aggregates = {
+        name: group_sum(team[with_record], team_events[name][with_record], teams)
+        for name in ["won", "lost", "tied"]
+    }
+
+    dcmp_years = np.unique(team_year[np.isin(team_events["event_type"], DCMP_TYPES)])
+    aggregates["dcmps"] = np.bincount(dcmp_years // 10000, minlength=teams)
 
+    # Each year's first two district events by week, ties kept in list order.
+    district = np.flatnonzero(team_events["event_type"] == EventType.DISTRICT)
+    district = district[
+        np.lexsort(
+            (
+                team_events["order"][district],
+                team_events["week"][district],
+                team_year[district],
+            )
+        )
+    ]
+    keys = team_year[district]
+    group_starts = np.diff(keys, prepend=-1) != 0
+    first_index = np.maximum.accumulate(np.where(group_starts, np.arange(len(keys)), 0))
+    first_two = district[np.arange(len(keys)) - first_index < 2]
+
+    aggregates["dpts_total"] = group_sum(
+        team[first_two], team_events["total_pts"][first_two], teams
+    )
+    aggregates["dpts_count"] = np.bincount(team[first_two], minlength=teams)
+    return aggregates
+
+
+@intermediate("team_data", "info", "team_aggregates")
+def team_data(info: DistrictInfo, aggregates: Dict[str, np.ndarray]) -> List[Dict]:
+    team_data = []
+    for team, (tk, t) in enumerate(info.summary.all_teams.items()):
+        dpts_count = int(aggregates["dpts_count"][team])
+        team_data.append(
+            {
+                "team": dataclasses.asdict(t),
+                "record": {
+                    "wins": int(aggregates["won"][team]),
+                    "losses": int(aggregates["lost"][team]),
+                    "ties": int(aggregates["tied"][team]),
+                },
+                "dcmps": int(aggregates["dcmps"][team]),
+                "epa": info.annual_info[t.active_years[-1]]
+                .team_events[t.key][-1]
+                .epa.normalized,
+                "avg_dpts": (
+                    int(aggregates["dpts_total"][team]) / dpts_count
+                    if dpts_count
+                    else 0
+                ),
+            }
+        )
+
+    return team_data
+
+
+@intermediate("district_rankings", "info")
+def district_rankings(info: DistrictInfo) -> Dict[str, Any]:
     rankings = {}
-    team_rankings: Dict[List[DistrictRanking]] = defaultdict(list)
+    team_rankings: Dict[str, RankingAverager] = defaultdict(RankingAverager)
     for y in district_years(info.summary.first_year):
         rankings[str(y)] = sorted(
             info.annual_info[y].rankings,
@@ -71,62 +267,22 @@ def process_district_index(info: DistrictInfo):
         )[:25]
 
         for r in info.annual_info[y].rankings:
-            team_rankings[r.team_key].append(r)
+            team_rankings[r.team_key].feed(r)
 
-    avged_ranks: List[DistrictRanking] = []
-    for tk, team_ranks in team_rankings.items():
-        if len(team_ranks) < 2:
-            continue
+    avged_ranks: List[DistrictRanking] = [
+        averager.get(tk)
+        for tk, averager in team_rankings.items()
+        if averager.rankings >= 2
+    ]
 
-        avged_ranks.append(
-            DistrictRanking(
-                qualifying_points_individual=[
-                    avg_nth_event(
-                        [
-                            r.qualifying_points_individual
-                            for r in team_ranks
-                            if r.qualifying_points_total > 0
-                        ],
-                        0,
-                    ),
-                    avg_nth_event(
-                        [
-                            r.qualifying_points_individual
-                            for r in team_ranks
-                            if r.qualifying_points_total > 0
-                        ],
-                        1,
-                    ),
-                ],
-                qualifying_points_total=avg(
-                    [
-                        r.qualifying_points_total
-                        for r in team_ranks
-                        if r.qualifying_points_total > 0
-                    ]
-                ),
-                dcmp_points=avg(
-                    [r.dcmp_points for r in team_ranks if r.dcmp_points > 0]
-                ),
-                rank=avg(
-                    [
-                        r.rank
-                        for r in team_ranks
-                        if r.qualifying_points_total > 0 and r.rank > 0
-                    ]
-                ),
-                age_bonus=0,
-                team_key=tk,
-            )
-        )
+    return {"by_year": rankings, "averaged": avged_ranks}
 
-    winners = []
+
+@intermediate("dcmp_finals", "info")
+def dcmp_finals(info: DistrictInfo) -> Dict[int, Optional[Event]]:
+    finals = {}
     for y in district_years(info.summary.first_year):
-        dcmps = [
-            e
-            for e in info.annual_info[y].events
-            if e.event_type in [EventType.DISTRICT_CMP, EventType.DISTRICT_CMP_DIVISION]
-        ]
+        dcmps = [e for e in info.annual_info[y].events if e.event_type in DCMP_TYPES]
 
         final_event = None
         if len(dcmps) == 1:
@@ -140,6 +296,19 @@ def process_district_index(info: DistrictInfo):
                 None,
             )
 
+        finals[y] = final_event
+
+    return finals
+
+
+@output("district/index.json", "info", "district_rankings", "dcmp_finals")
+def process_district_index(
+    info: DistrictInfo,
+    district_rankings: Dict[str, Any],
+    dcmp_finals: Dict[int, Optional[Event]],
+) -> Dict:
+    winners = []
+    for y, final_event in dcmp_finals.items():
         if final_event is None:
             winners.append({"year": y, "teams": []})
             continue
@@ -157,16 +326,13 @@ def process_district_index(info: DistrictInfo):
 
         winners.append({"year": y, "teams": winning_alliance.teams})
 
-    data = {
+    return {
         "summary": info.summary.to_dict(),
         # "team_data": team_data,
         "teams_per_year": {
             y: Counter(
-                [
-                    t.state_prov
-                    for t in info.summary.all_teams.values()
-                    if y in t.active_years
-                ]
+                info.summary.all_teams[tk].state_prov
+                for tk in info.summary.teams_by_year.get(y, [])
             )
             for y in district_years(info.summary.first_year)
         },
@@ -174,12 +340,15 @@ def process_district_index(info: DistrictInfo):
             "overall": [
                 x.to_dict()
                 for x in sorted(
-                    [r for r in avged_ranks if r.rank > 0],
+                    [r for r in district_rankings["averaged"] if r.rank > 0],
                     key=lambda r: (r.dcmp_points + r.qualifying_points_total),
                     reverse=True,
                 )[:25]
             ],
-            "by_year": {k: [x.to_dict() for x in v] for k, v in rankings.items()},
+            "by_year": {
+                k: [x.to_dict() for x in v]
+                for k, v in district_rankings["by_year"].items()
+            },
         },
         "events": {
             "total": sum([len(ai.events) for ai in info.annual_info.values()]),
@@ -188,8 +357,66 @@ def process_district_index(info: DistrictInfo):
         "winners": winners,
     }
 
+
+def inputs_digest(annual_info_path: str) -> str:
+    # Outputs depend on the district's data and on the code that computes them.
+    h = hashlib.sha256(SOURCES_DIGEST)
+    with open(annual_info_path, "rb") as f:
+        h.update(hashlib.file_digest(f, "sha256").digest())
+
+    return h.hexdigest()
+
+
+def compute_outputs(
+    paths: List[str], load_info: Callable[[], DistrictInfo]
+) -> Dict[str, Any]:
+    # Only what these outputs need is computed, each piece at most once.
+    results: Dict[str, Any] = {}
+
+    def resolve(name: str) -> Any:
+        if name not in results:
+            if name == "info":
+                results[name] = load_info()
+            else:
+                step = INTERMEDIATES[name]
+                results[name] = step.fn(*[resolve(i) for i in step.inputs])
+
+        return results[name]
+
+    return {
+        path: OUTPUTS[path].fn(*[resolve(i) for i in OUTPUTS[path].inputs])
+        for path in paths
+    }
+
+
+def run_processors(
+    district_key: str,
+    annual_info_path: str,
+    load_info: Callable[[], DistrictInfo],
+    force: bool = False,
+) -> List[str]:
+    digest = inputs_digest(annual_info_path)
+    try:
+        processed = {} if force else read_district_data(district_key, "processed.json")
+    except FileNotFoundError:
+        processed = {}
+
+    stale = [
+        path
+        for path in OUTPUTS
+        if processed.get(path) != digest
+        or not os.path.exists(f"data/out/{district_key}/{path}")
+    ]
+    if not stale:
+        return []
+
+    for path, data in compute_outputs(stale, load_info).items():
+        write_district_data(
+            district_key, path, json.dumps(data, indent=2, sort_keys=True)
+        )
+        processed[path] = digest
+
     write_district_data(
-        info.summary.key,
-        "district/index.json",
-        json.dumps(data, indent=2, sort_keys=True),
+        district_key, "processed.json", json.dumps(processed, indent=2, sort_keys=True)
     )
+    return stale
@@ -1,6 +1,10 @@
+import dataclasses
 from pathlib import Path
-from typing import List, Union
+from typing import Any, List, Union
 import json
+import os
+
+from numpyencoder import NumpyEncoder
 
 CURRENT_YEAR = 2024
 
@@ -91,9 +95,30 @@ def write_district_data(district_key: str, relative_path: str, data):
     path = f"data/out/{district_key}/{relative_path}"
 
     Path(path_without_filename).mkdir(parents=True, exist_ok=True)
-    with open(path, "w+") as f:
+    # Swapped into place so a running API never reads a half-written file.
+    with open(f"{path}.tmp", "w+") as f:
         f.write(data)
 
+    os.replace(f"{path}.tmp", path)
+
+
+class ShallowDataclassEncoder(NumpyEncoder):
+    # Lets json walk dataclasses field by field instead of deep-copying them into
+    # dicts with dataclasses.asdict first.
+    def default(self, obj):
+        if dataclasses.is_dataclass(obj):
+            return {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+
+        return super().default(obj)
+
+
+def indented_json(obj: Any, depth: int = 0) -> str:
+    # The text json.dumps(indent=2, sort_keys=True) would produce for obj when it
+    # sits `depth` levels deep inside a larger document.
+    return json.dumps(
+        obj, indent=2, sort_keys=True, cls=ShallowDataclassEncoder
+    ).replace("\n", "\n" + "  " * depth)
+
 
 def read_district_data(district_key: str, relative_path: str):
     with open(f"data/out/{district_key}/{relative_path}", "r") as f:
@@ -144,6 +144,7 @@ export interface Summary {
   key: string;
   name: string;
   first_year: number;
+  teams_by_year?: { [year: string]: string[] };
 }
 
 export interface SimpleTeam {